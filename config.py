@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import os
 import yaml
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Any, Mapping
 
 class Config:
     """Configuration handler for runcmd_generator"""
     
     _instance = None
     _config = None
+    _config_view = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -24,15 +28,17 @@ class Config:
         config_path = os.path.join(os.path.dirname(__file__), 'config.yaml')
         try:
             with open(config_path, 'r') as f:
-                self._config = yaml.safe_load(f)
+                self._config = yaml.safe_load(f) or {}
         except Exception as e:
             print(f"Error loading config from {config_path}: {e}")
             self._config = {}
+        # Read-only view shared by every caller instead of copying the dict on each access
+        self._config_view = MappingProxyType(self._config)
     
     @property
-    def all(self) -> Dict[str, Any]:
-        """Get all configuration values"""
-        return self._config.copy()
+    def all(self) -> Mapping[str, Any]:
+        """Get all configuration values as a read-only mapping"""
+        return self._config_view
     
     def get(self, key: str, default: Any = None) -> Any:
         """Get a configuration value by key"""
@@ -1,25 +1,46 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import os
 import re
 import subprocess
-import json
 import sys
 import importlib.util
-from datetime import datetime
-from typing import List, Dict, Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import List, Dict, Optional, Tuple
 from modules.dx_command_generator import DXCommandGenerator
+from modules.dx_utils import PAN_NUMBER_RE
+
+# ExomeDepth CNV calling job for a single Pan number
+_CNV_COMMAND_TEMPLATE = (
+    "dx run {cnv_applet_id} "
+    "--priority high -y "
+    "--name ED_CNVcalling-{pan_number} "
+    "-ireadcount_file={readcount_file} "
+    "-ibam_str=markdup "
+    "-ireference_genome={reference_genome} "
+    "-isamplename_str=_markdup.bam "
+    "-isubpanel_bed={cnv_bedfile} "
+    "-iproject_name={project_name} "
+    "-ibamfile_pannumbers={pan_number} "
+    "--dest={project_id} --brief -y\n"
+)
 
 class CNVCommandGenerator(DXCommandGenerator):
     """Generates CNV analysis commands for samples in a DNAnexus project"""
 
+    # PANEL_DICT loaded from panel_config.py, keyed by (path, mtime_ns) so edits to the file are picked up
+    _panel_cache: Dict[Tuple[str, int], Dict] = {}
+
     def __init__(self):
         super().__init__()
         self.panel_config = self._fetch_panel_config()
         self.cnv_applet_id = self.config_values.get('cnv_applet')
         self.common_data_project = self.config_values.get('common_data_project')
         self.reference_genome = self.config_values.get('reference_genome')
-
+        self._cnv_bedfiles = self._build_cnv_bedfile_lookup()
 
     def _fetch_panel_config(self) -> Dict:
         """Load the panel configuration from local file"""
@@ -28,6 +49,10 @@ class CNVCommandGenerator(DXCommandGenerator):
             config_path = self.config_values.get('as_panel_config')
             if not config_path:
                 raise ValueError("Panel config path not found in config file")
+
+            cache_key = (config_path, os.stat(config_path).st_mtime_ns)
+            if cache_key in self._panel_cache:
+                return self._panel_cache[cache_key]
             
             # Load the module using importlib
             spec = importlib.util.spec_from_file_location("panel_config", config_path)
@@ -39,7 +64,9 @@ class CNVCommandGenerator(DXCommandGenerator):
             
             # Get the PanelConfig class and access PANEL_DICT
             if hasattr(module, 'PanelConfig'):
-                return module.PanelConfig.PANEL_DICT
+                panel_dict = module.PanelConfig.PANEL_DICT
+                self._panel_cache[cache_key] = panel_dict
+                return panel_dict
             else:
                 raise AttributeError("PanelConfig class not found in panel_config.py")
                 
@@ -48,25 +75,25 @@ class CNVCommandGenerator(DXCommandGenerator):
             print("Falling back to default configuration")
             return {}
 
+    def _build_cnv_bedfile_lookup(self) -> Dict[str, Optional[str]]:
+        """Map every Pan number in the panel configuration to its CNV bedfile path, or None if it has none"""
+        cnv_bedfiles: Dict[str, Optional[str]] = {}
+        for pan_number, panel_info in self.panel_config.items():
+            cnv_bedfile = panel_info.get('ed_cnvcalling_bedfile')
+            # Use common_data_project from config
+            cnv_bedfiles[pan_number] = f"{self.common_data_project}:/Data/BED/{cnv_bedfile}_CNV.bed" if cnv_bedfile else None
+        return cnv_bedfiles
+
     def _get_cnv_bedfile(self, pan_number: str) -> Optional[str]:
         """Get the CNV bedfile for a given pan number"""
-        try:
-            panel_info = self.panel_config.get(pan_number)
-            if panel_info is None:
-                print(f"Warning: Pan number {pan_number} not found in panel configuration. No BED file can be retrieved.", file=sys.stderr)
-                return None
-                
-            cnv_bedfile = panel_info.get('ed_cnvcalling_bedfile')
-            if cnv_bedfile:
-                # Use common_data_project from config
-                return f"{self.common_data_project}:/Data/BED/{cnv_bedfile}_CNV.bed"
-            else:
-                print(f"Note: Pan number {pan_number} found but has no CNV bedfile configured - skipping CNV analysis", file=sys.stderr)
-                return None
-                
-        except Exception as e:
-            print(f"Error: Failed to process {pan_number}: {e}", file=sys.stderr)
-            raise
+        if pan_number not in self._cnv_bedfiles:
+            print(f"Warning: Pan number {pan_number} not found in panel configuration. No BED file can be retrieved.", file=sys.stderr)
+            return None
+
+        cnv_bedfile = self._cnv_bedfiles[pan_number]
+        if cnv_bedfile is None:
+            print(f"Note: Pan number {pan_number} found but has no CNV bedfile configured - skipping CNV analysis", file=sys.stderr)
+        return cnv_bedfile
 
     @property
     def name(self) -> str:
@@ -103,24 +130,30 @@ class CNVCommandGenerator(DXCommandGenerator):
             print(f"  Project ID: {project_id}")
             print(f"  Project Name: {project_name}")
 
-            pan_numbers = self._extract_pan_numbers(dxfile_id)
-            if not pan_numbers:
-                print("Error: No Pan numbers found in the manifest file.")
-                return
+            # Reading the manifest and searching for the readcount file are independent dx round-trips
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                pan_numbers_future = executor.submit(self._extract_pan_numbers, dxfile_id)
+                readcount_file_future = executor.submit(self._find_readcount_file, project_id)
+                # Sorted once here; printing and command generation both follow this order
+                pan_numbers = sorted(pan_numbers_future.result() or ())
 
-            print(f"\nFound {len(pan_numbers)} unique Pan numbers:")
-            for pan in sorted(pan_numbers):
-                print(f"  - {pan}")
+                # Checked before the readcount result is collected, so a failed readcount query
+                # cannot end the run before the manifest error is reported
+                if not pan_numbers:
+                    print("Error: No Pan numbers found in the manifest file.")
+                    return
+
+                print(f"\nFound {len(pan_numbers)} unique Pan numbers:")
+                for pan in pan_numbers:
+                    print(f"  - {pan}")
+
+                readcount_file = readcount_file_future.result()
 
-            readcount_file = self._find_readcount_file(project_id)
             if not readcount_file:
                 print("Error: Could not find .RData readcount file in the project.")
                 return
 
             output_file = f"{project_name.replace(' ', '_')}_cnv_cmds.sh"
-            
-            if not self._initialize_output_file(output_file, project_id, project_name, "CNV Analysis Commands", include_project_vars=False):
-                return
 
             self._generate_cnv_commands(
                 pan_numbers=pan_numbers,
@@ -153,37 +186,34 @@ class CNVCommandGenerator(DXCommandGenerator):
             
         return readcount_files_data[0]['id']
 
-    def _generate_cnv_commands(self, pan_numbers: Set[str], readcount_file: str,
+    def _generate_cnv_commands(self, pan_numbers: List[str], readcount_file: str,
                                  project_id: str, project_name: str, output_file: str) -> None:
         """Generate CNV analysis commands for each Pan number"""
         try:
-            with open(output_file, 'a') as f: # Append to initialized file
-                for pan_number in sorted(pan_numbers):
-                    # Get the CNV bedfile - skip this pan if no bedfile configured
-                    cnv_bedfile = self._get_cnv_bedfile(pan_number)
-                    if cnv_bedfile is None:
-                        continue
-                        
-                    command = (
-                        f"dx run {self.cnv_applet_id} " # Use applet from config
-                        f"--priority high -y "
-                        f"--name ED_CNVcalling-{pan_number} "
-                        f"-ireadcount_file={readcount_file} "
-                        f"-ibam_str=markdup "
-                        f"-ireference_genome={self.reference_genome} " # Use reference genome from config
-                        f"-isamplename_str=_markdup.bam "
-                        f"-isubpanel_bed={cnv_bedfile} "
-                        f"-iproject_name={project_name} "
-                        f"-ibamfile_pannumbers={pan_number} "
-                        f"--dest={project_id} --brief -y\n"
-                    )
-                    f.write(command)
-
-                print(f"\nSuccessfully generated commands for CNV analysis")
-                print(f"Output written to: {output_file}")
-
-        except IOError as e:
-            print(f"Error writing to output file {output_file}: {e}")
+            commands: List[str] = []
+            for pan_number in pan_numbers:
+                # Get the CNV bedfile - skip this pan if no bedfile configured
+                cnv_bedfile = self._get_cnv_bedfile(pan_number)
+                if cnv_bedfile is None:
+                    continue
+
+                commands.append(_CNV_COMMAND_TEMPLATE.format(
+                    cnv_applet_id=self.cnv_applet_id, # Use applet from config
+                    pan_number=pan_number,
+                    readcount_file=readcount_file,
+                    reference_genome=self.reference_genome, # Use reference genome from config
+                    cnv_bedfile=cnv_bedfile,
+                    project_name=project_name,
+                    project_id=project_id
+                ))
+
+            if not self._write_output_script(output_file, project_id, project_name, "CNV Analysis Commands",
+                                             include_project_vars=False, body="".join(commands)):
+                return
+
+            print(f"\nSuccessfully generated commands for CNV analysis")
+            print(f"Output written to: {output_file}")
+
         except Exception as e:
             print(f"An unexpected error occurred while generating commands: {e}")
 
@@ -206,33 +236,26 @@ class CNVReanalysisCommandGenerator(CNVCommandGenerator):
         """
         print(f"Searching RunManifest.csv ({dxfile_id}) for original Pan number for sample: {sample_identifier}")
         try:
-            dx_cat_cmd = ["dx", "cat", dxfile_id]
-            # Capture stderr to suppress dx tool messages unless an actual error occurs
-            process = subprocess.run(dx_cat_cmd, capture_output=True, text=True, check=False)
-
-            if process.returncode != 0:
-                print(f"Error reading manifest file {dxfile_id}: {process.stderr}", file=sys.stderr)
-                return None
-
-            manifest_content = process.stdout
-
-            for line in manifest_content.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-
-                # Looks for the sample_identifier (case-insensitive) anywhere in the line,
-                # then captures the first 'Pan\d+' found in that same line.
-                if sample_identifier in line: # Simple check first to narrow down lines
-                    pan_match = re.search(r'(Pan\d+)', line, re.IGNORECASE)
+            # The first line containing the sample_identifier (case-sensitive) that also has a
+            # 'Pan\d+' (case-insensitive), capturing the first such Pan
+            pan_line_re = re.compile(rf"^(?=.*?{re.escape(sample_identifier)}).*?((?i:Pan)\d+)")
+
+            # Stop reading as soon as the sample is found; closing the stream stops dx
+            with closing(self._iter_dx_cat_lines(dxfile_id)) as manifest_lines:
+                for line in manifest_lines:
+                    pan_match = pan_line_re.search(line)
                     if pan_match:
                         original_pan = pan_match.group(1)
                         print(f"Found original Pan number for {sample_identifier}: {original_pan}")
                         return original_pan
-            
+
             print(f"Warning: Original Pan number for sample {sample_identifier} not found in RunManifest.csv.")
             return None
 
+        except subprocess.CalledProcessError as e:
+            # dx tool messages are only shown when an actual error occurs
+            print(f"Error reading manifest file {dxfile_id}: {e.stderr}", file=sys.stderr)
+            return None
         except FileNotFoundError:
             print(f"Error: 'dx' command not found. Please ensure the DNAnexus toolkit is installed and in your PATH.", file=sys.stderr)
             return None
@@ -259,10 +282,16 @@ class CNVReanalysisCommandGenerator(CNVCommandGenerator):
                 return
             
             new_pan_number = input("Enter NEW Pan number for reanalysis (e.g., Pan1234): ").strip()
-            if not re.fullmatch(r'Pan\d+', new_pan_number, re.IGNORECASE):
+            if not PAN_NUMBER_RE.fullmatch(new_pan_number):
                 print("Error: Invalid NEW Pan number format. Must be 'Pan' followed by digits (e.g., Pan1234).")
                 return
 
+            # A config lookup, so checked before any dx call is made
+            cnv_bedfile = self._get_cnv_bedfile(new_pan_number)
+            if cnv_bedfile is None:
+                print(f"Error: No CNV bedfile configured for NEW Pan number {new_pan_number}. Cannot proceed with reanalysis.")
+                return
+
             project_id, project_name = self._detect_project_info(dxfile_id)
             if not project_id or not project_name:
                 print("Error: Could not detect project information from the provided file.")
@@ -272,45 +301,44 @@ class CNVReanalysisCommandGenerator(CNVCommandGenerator):
             print(f"  Project ID: {project_id}")
             print(f"  Project Name: {project_name}")
 
-            readcount_file = self._find_readcount_file(project_id)
-            if not readcount_file:
-                print("Error: Could not find .RData readcount file in the project.")
-                return
+            # The readcount query is a single short API call, so it runs in the background while the
+            # manifest is searched; leaving the block after a failed search waits only for that call
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                readcount_file_future = executor.submit(self._find_readcount_file, project_id)
 
-            cnv_bedfile = self._get_cnv_bedfile(new_pan_number)
-            if cnv_bedfile is None:
-                print(f"Error: No CNV bedfile configured for NEW Pan number {new_pan_number}. Cannot proceed with reanalysis.")
-                return
+                # Get the original Pan number from the manifest for the specific sample
+                original_pan_number = self._find_original_pan_for_sample(dxfile_id, sample_identifier)
+                if original_pan_number is None:
+                    print(f"Error: Could not find original Pan number for sample {sample_identifier} in the manifest. Cannot proceed.")
+                    return
 
-            # Get the original Pan number from the manifest for the specific sample
-            original_pan_number = self._find_original_pan_for_sample(dxfile_id, sample_identifier)
-            if original_pan_number is None:
-                print(f"Error: Could not find original Pan number for sample {sample_identifier} in the manifest. Cannot proceed.")
-                return
-            
+                readcount_file = readcount_file_future.result()
+                if not readcount_file:
+                    print("Error: Could not find .RData readcount file in the project.")
+                    return
 
             output_file = f"{project_name.replace(' ', '_')}_cnv_reanalysis_cmds.sh"
 
-            if not self._initialize_output_file(output_file, project_id, project_name, "CNV ExomeDepth Reanalysis Commands", include_project_vars=False):
+            command = (
+                f"JOB_ID_CNV_REANALYSIS_{original_pan_number}=$(dx run {self.cnv_applet_id} "
+                f"--priority high -y "
+                f"--name ED_CNVcallingREANALYSIS-{new_pan_number} "
+                f"-ireadcount_file={readcount_file} "
+                f"-ibam_str=markdup "
+                f"-ireference_genome={self.reference_genome} "
+                f"-isamplename_str=_markdup.bam "
+                f"-isubpanel_bed={cnv_bedfile} "
+                f"-iproject_name={project_name} "
+                f"-ibamfile_pannumbers={original_pan_number} "
+                f"--dest={project_id}:/exomedepth_output/{new_pan_number} --brief -y)\n"
+            )
+
+            if not self._write_output_script(output_file, project_id, project_name, "CNV ExomeDepth Reanalysis Commands",
+                                             include_project_vars=False, body=command):
                 return
 
-            with open(output_file, 'a') as f:
-                command = (
-                    f"JOB_ID_CNV_REANALYSIS_{original_pan_number}=$(dx run {self.cnv_applet_id} "
-                    f"--priority high -y "
-                    f"--name ED_CNVcallingREANALYSIS-{new_pan_number} "
-                    f"-ireadcount_file={readcount_file} "
-                    f"-ibam_str=markdup "
-                    f"-ireference_genome={self.reference_genome} "
-                    f"-isamplename_str=_markdup.bam "
-                    f"-isubpanel_bed={cnv_bedfile} "
-                    f"-iproject_name={project_name} "
-                    f"-ibamfile_pannumbers={original_pan_number} "
-                    f"--dest={project_id}:/exomedepth_output/{new_pan_number} --brief -y)\n"
-                )
-                f.write(command)
-                print(f"\nGenerated CNV reanalysis command for sample {sample_identifier} (Original Pan: {original_pan_number}) with NEW panel {new_pan_number}")
-                print(f"Output written to: {output_file}")
+            print(f"\nGenerated CNV reanalysis command for sample {sample_identifier} (Original Pan: {original_pan_number}) with NEW panel {new_pan_number}")
+            print(f"Output written to: {output_file}")
 
         except EOFError:
             print("\nInput cancelled. Exiting.")
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
 from modules.dx_command_generator import DXCommandGenerator
 
@@ -27,71 +30,75 @@ class CoverageCommandGenerator(DXCommandGenerator):
         if not project_id:
             return
 
-        project_name = self._get_project_name(project_id)
-        if not project_name:
-            project_name = f"{project_id}_unknown_project" # Fallback if name not found
-            print(f"Could not determine project name, using '{project_name}' for output filename")
-        else:
-            print(f"Using project name '{project_name}' for output filename")
-        
-        output_file = f"{project_name.replace(' ', '_')}_coverage_cmds.sh"
+        # The file query does not depend on the project name, so run it while the name is looked up
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            bam_bai_pairs_future = executor.submit(self._find_bam_bai_pairs, project_id)
 
-        print(f"\nStarting coverage command generation for project: {project_id}")
-        print(f"Commands will be written to: {output_file}")
+            project_name = self._get_project_name(project_id)
+            if not project_name:
+                project_name = f"{project_id}_unknown_project" # Fallback if name not found
+                print(f"Could not determine project name, using '{project_name}' for output filename")
+            else:
+                print(f"Using project name '{project_name}' for output filename")
+            
+            output_file = f"{project_name.replace(' ', '_')}_coverage_cmds.sh"
 
-        if not self._initialize_output_file(output_file, project_id, project_name, "Coverage Analysis Commands"):
-            return
+            print(f"\nStarting coverage command generation for project: {project_id}")
+            print(f"Commands will be written to: {output_file}")
 
-        bam_bai_pairs = self._find_bam_bai_pairs(project_id)
+            bam_bai_pairs = bam_bai_pairs_future.result()
 
         if not bam_bai_pairs:
             print("No BAM/BAI pairs found. No commands will be generated.")
             return
 
-        self._generate_coverage_commands(bam_bai_pairs, output_file, project_id)
+        self._generate_coverage_commands(bam_bai_pairs, output_file, project_id, project_name)
 
     def _find_bam_bai_pairs(self, project_id: str) -> List[Tuple[str, str]]:
-        """Finds BAM/BAI pairs in the project using common utility"""
-        bam_glob_pattern = "*markdup.bam"
-        bai_glob_pattern = "*markdup.bam.bai"
+        """Finds BAM/BAI pairs in the project using a single combined query"""
+        # One query covers both the BAMs and their indexes; split them by suffix as results arrive
+        bam_files_data: List[Dict] = []
+        bai_files_data: List[Dict] = []
+        for item in self._iter_dx_files(project_id, "*markdup.bam*"):
+            file_name = item.get('describe', {}).get('name', '')
+            if file_name.endswith(".bam.bai"):
+                bai_files_data.append(item)
+            elif file_name.endswith(".bam"):
+                bam_files_data.append(item)
 
-        bam_files_data = self._find_dx_files(project_id, bam_glob_pattern)
-        bai_files_data = self._find_dx_files(project_id, bai_glob_pattern)
-        
         return self._pair_dx_files(bam_files_data, ".bam", bai_files_data, ".bam.bai")
 
     def _generate_coverage_commands(self, bam_bai_pairs: List[Tuple[str, str]], 
-                                     output_file: str, project_id: str) -> None:
+                                     output_file: str, project_id: str, project_name: str) -> None:
         """Generates coverage analysis commands"""
-        # Base command template
-        base_command = (
+        # Constant parts of the command around the BAM and BAI IDs, built once for all pairs
+        command_prefix = (
             f"dx run {self.chanjo_sambamba_coverage} " # Use applet from config
             "-icoverage_level=30 "
-            "-ibamfile={bam_id} "
-            "-ibam_index={bai_id} "
-            "-imin_base_qual=10 "
+            "-ibamfile="
+        )
+        command_middle = " -ibam_index="
+        command_suffix = (
+            " -imin_base_qual=10 "
             "-imin_mapping_qual=20 "
             "-iadditional_filter_commands=\"not (unmapped or secondary_alignment)\" "
             "-iexclude_duplicate_reads=true "
             "-iexclude_failed_quality_control=true "
             "-imerge_overlapping_mate_reads=true "
             f"-isambamba_bed={self.sambamba_bed} " # Use sambamba_bed from config
-            f"--dest {project_id} -y"
+            f"--dest {project_id} -y\n"
         )
 
-        try:
-            with open(output_file, 'a') as f: # Append to initialized file
-                for i, (bam_id, bai_id) in enumerate(bam_bai_pairs, 1):
-                    command = base_command.format(bam_id=bam_id, bai_id=bai_id)
-                    f.write(f"{command}\n")
-                    print(f"Generated command {i}/{len(bam_bai_pairs)} for BAM: {bam_id}", file=sys.stderr)
+        commands: List[str] = []
+        for bam_id, bai_id in bam_bai_pairs:
+            commands.append(command_prefix + bam_id + command_middle + bai_id + command_suffix)
 
-            print(f"\nSuccessfully wrote {len(bam_bai_pairs)} commands to {output_file}", file=sys.stderr)
-
-        except IOError as e:
-            print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
+        if not self._write_output_script(output_file, project_id, project_name, "Coverage Analysis Commands",
+                                         body="".join(commands)):
             sys.exit(1)
 
+        print(f"\nSuccessfully wrote {len(bam_bai_pairs)} commands to {output_file}", file=sys.stderr)
+
 if __name__ == "__main__":
     generator = CoverageCommandGenerator()
     generator.generate()
\ No newline at end of file
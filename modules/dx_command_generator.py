@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import os
 import sys
+import tempfile
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple, Set, Any
+from typing import List, Dict, Iterator, Optional, Tuple, Set, Any
 from abc import ABC, abstractmethod
 from modules.dx_utils import DXUtils
 from config import Config
@@ -38,10 +42,6 @@ class DXCommandGenerator(ABC):
         """Generate the commands"""
         pass
 
-    def _run_dx_find_command(self, dx_command_args: List[str], command_description: str) -> List[Dict]:
-        """Wrapper for DXUtils.run_dx_find_command."""
-        return DXUtils.run_dx_find_command(dx_command_args, command_description)
-
     def _get_project_name(self, project_id: str) -> Optional[str]:
         """Wrapper for DXUtils.get_project_name."""
         return DXUtils.get_project_name(project_id)
@@ -54,6 +54,10 @@ class DXCommandGenerator(ABC):
         """Wrapper for DXUtils.extract_pan_numbers."""
         return DXUtils.extract_pan_numbers(dx_file_id)
 
+    def _iter_dx_cat_lines(self, dx_file_id: str) -> Iterator[str]:
+        """Wrapper for DXUtils.iter_dx_cat_lines."""
+        return DXUtils.iter_dx_cat_lines(dx_file_id)
+
     def _get_auth_token(self) -> str:
         """Wrapper for DXUtils.get_auth_token, using config path."""
         return DXUtils.get_auth_token(self.config_values['dnanexus_auth_token_path'])
@@ -61,8 +65,10 @@ class DXCommandGenerator(ABC):
     def _get_project_id_from_input(self, prompt_message: str) -> Optional[str]:
         """
         Prompts the user for a DNAnexus project ID or reads it from sys.argv.
+        Options such as --no-cache are not taken as the project ID.
         """
-        if len(sys.argv) != 2:
+        positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("-")]
+        if len(positional_args) != 1:
             print(f"\n{self.name} Configuration:")
             print("---------------------------")
             project_id = input(f"{prompt_message} (e.g., project-xxxx): ").strip()
@@ -75,53 +81,78 @@ class DXCommandGenerator(ABC):
                 print("Error: Invalid DNAnexus file ID format. Must start with 'project-'")
                 return None
         else:
-            project_id = sys.argv[1]
+            project_id = positional_args[0]
         return project_id
 
-    def _initialize_output_file(self, output_file: str, project_id: str,
-                                project_name: str, script_description: str,
-                                include_project_vars: bool = True) -> bool:
+    def _write_output_script(self, output_file: str, project_id: str,
+                             project_name: str, script_description: str, body: str,
+                             include_project_vars: bool = True) -> bool:
         """
-        Initializes the output shell script with a shebang, header, and makes it executable.
-        Optionally includes AUTH_TOKEN, PROJECT_ID, and PROJECT_NAME variables.
+        Writes the complete, executable output shell script: a shebang and header, optionally
+        the AUTH_TOKEN, PROJECT_ID and PROJECT_NAME variables, then `body` (the generated commands).
+        Generators call this once, after all their commands are built. Together with the atomic
+        write, a failed or interrupted run therefore never leaves a partial or header-only script.
         Returns True on success, False on failure.
         """
         try:
-            with open(output_file, 'w') as f:
-                f.write("#!/bin/bash\n")
-                f.write(f"# {script_description}\n")
-                f.write(f"# Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"# Project: {project_name} ({project_id})\n\n")
-
-                if include_project_vars:
-                    auth_token = self._get_auth_token()
-                    f.write(f"AUTH_TOKEN=\"{auth_token}\"\n")
-                    f.write(f"PROJECT_ID=\"{project_id}\"\n")
-                    f.write(f"PROJECT_NAME=\"{project_name}\"\n\n")
-
-            os.chmod(output_file, 0o755)
-            print(f"\nSuccessfully initialized output script: {output_file}")
+            header = (
+                "#!/bin/bash\n"
+                f"# {script_description}\n"
+                f"# Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"# Project: {project_name} ({project_id})\n\n"
+            )
+
+            if include_project_vars:
+                auth_token = self._get_auth_token()
+                header += (
+                    f"AUTH_TOKEN=\"{auth_token}\"\n"
+                    f"PROJECT_ID=\"{project_id}\"\n"
+                    f"PROJECT_NAME=\"{project_name}\"\n\n"
+                )
+
+            self._write_output_file_atomically(output_file, header + body)
+            print(f"\nSuccessfully wrote output script: {output_file}")
             return True
         except IOError as e:
             print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
             return False
         except Exception as e:
-            print(f"An unexpected error occurred during output file initialization: {e}", file=sys.stderr)
+            print(f"An unexpected error occurred while writing output script {output_file}: {e}", file=sys.stderr)
             return False
 
+    def _write_output_file_atomically(self, output_file: str, content: str) -> None:
+        """
+        Writes content to an executable output script via a temporary file in the same
+        directory that then replaces the target, so an interrupted run never leaves a
+        truncated script behind. Raises OSError on failure.
+        """
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix=f".{os.path.basename(output_file)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fchmod(f.fileno(), 0o755)
+                os.fsync(f.fileno())
+            os.replace(temp_path, output_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
     def _find_dx_files(self, project_id: str, glob_pattern: str, file_class: str = "file") -> List[Dict]:
         """
         Finds DNAnexus files matching a glob pattern in a given project.
         Returns a list of dictionaries, each containing 'id' and 'describe' keys.
+        Only the file name is requested in 'describe', keeping the query payload small.
+        """
+        return DXUtils.find_data_objects(project_id, glob_pattern, file_class, describe_fields=("name",))
+
+    def _iter_dx_files(self, project_id: str, glob_pattern: str, file_class: str = "file") -> Iterator[Dict]:
         """
-        dx_command_args = [
-            "dx", "find", "data",
-            "--name", glob_pattern,
-            "--class", file_class,
-            "--project", project_id,
-            "--json"
-        ]
-        return self._run_dx_find_command(dx_command_args, f"'{glob_pattern}' file query")
+        Streaming variant of _find_dx_files: yields matching files one result page at a time.
+        """
+        return DXUtils.iter_data_objects(project_id, glob_pattern, file_class, describe_fields=("name",))
 
     def _pair_dx_files(self, primary_files_data: List[Dict], primary_suffix: str,
                        secondary_files_data: List[Dict], secondary_suffix: str,
@@ -131,59 +162,61 @@ class DXCommandGenerator(ABC):
         `base_name_transform` is an optional function to apply to the filename before extracting base name.
         Returns a list of (primary_file_id, secondary_file_id) tuples.
         """
-        primary_files: Dict[str, str] = {}
-        secondary_files: Dict[str, str] = {}
-
-        for item in primary_files_data:
-            try:
-                file_id = item['id']
-                file_name = item['describe']['name']
-                # Apply transform first if provided, then strip suffix
-                processed_file_name = base_name_transform(file_name) if base_name_transform else file_name
-
-                if processed_file_name.endswith(primary_suffix):
-                    base_name = processed_file_name[:-len(primary_suffix)]
-                    primary_files[base_name] = file_id
-                else:
-                    print(f"Warning: Primary file '{file_name}' (ID: {file_id}) from query did not end with '{primary_suffix}' after transform. Skipping.", file=sys.stderr)
-            except KeyError as e:
-                print(f"Skipping primary item due to missing key {e} in JSON item: {item}", file=sys.stderr)
-                continue
-        
-        for item in secondary_files_data:
-            try:
-                file_id = item['id']
-                file_name = item['describe']['name']
-                # Apply transform first if provided, then strip suffix
-                processed_file_name = base_name_transform(file_name) if base_name_transform else file_name
-
-                if processed_file_name.endswith(secondary_suffix):
-                    base_name = processed_file_name[:-len(secondary_suffix)]
-                    secondary_files[base_name] = file_id
-                else:
-                    print(f"Warning: Secondary file '{file_name}' (ID: {file_id}) from query did not end with '{secondary_suffix}'. Skipping.", file=sys.stderr)
-            except KeyError as e:
-                print(f"Skipping secondary item due to missing key {e} in JSON item: {item}", file=sys.stderr)
-                continue
-        
-        print(f"\nIdentified {len(primary_files)} unique primary base names for pairing.", file=sys.stderr)
-        print(f"Identified {len(secondary_files)} unique secondary base names for pairing.", file=sys.stderr)
-
-        pairs: List[Tuple[str, str]] = []
-        unpaired_primary_count = 0
-        orphaned_secondary_count = 0
-
-        for base_name, primary_id in sorted(primary_files.items()):
-            if base_name in secondary_files:
-                pairs.append((primary_id, secondary_files[base_name]))
+        # Hash join keyed by base name; each value holds [primary_file_id, secondary_file_id]
+        joined: Dict[str, List[Optional[str]]] = defaultdict(lambda: [None, None])
+        # Warnings are collected and written to stderr in one call per stage rather than printed one by one
+        skip_warnings: List[str] = []
+
+        # Only the primary name is transformed before the suffix check, hence the extra wording
+        for slot, files_data, suffix, label, suffix_note in (
+                (0, primary_files_data, primary_suffix, "Primary", " after transform"),
+                (1, secondary_files_data, secondary_suffix, "Secondary", "")):
+            for item in files_data:
+                try:
+                    file_id = item['id']
+                    file_name = item['describe']['name']
+                    # Apply transform first if provided, then strip suffix
+                    processed_file_name = base_name_transform(file_name) if base_name_transform else file_name
+
+                    # removesuffix checks and strips in one call; an unchanged name means no match
+                    base_name = processed_file_name.removesuffix(suffix)
+                    if base_name != processed_file_name:
+                        joined[base_name][slot] = file_id
+                    else:
+                        skip_warnings.append(f"Warning: {label} file '{file_name}' (ID: {file_id}) from query did not end with '{suffix}'{suffix_note}. Skipping.\n")
+                except KeyError as e:
+                    skip_warnings.append(f"Skipping {label.lower()} item due to missing key {e} in JSON item: {item}\n")
+                    continue
+
+        if skip_warnings:
+            sys.stderr.write("".join(skip_warnings))
+
+        paired: List[Tuple[str, str, str]] = []
+        unpaired_primaries: List[Tuple[str, str]] = []
+        orphaned_secondary_warnings: List[str] = []
+
+        # Single pass classifies each base name as a pair, an unpaired primary or an orphaned secondary
+        for base_name, (primary_id, secondary_id) in joined.items():
+            if primary_id is not None and secondary_id is not None:
+                paired.append((base_name, primary_id, secondary_id))
+            elif secondary_id is None:
+                unpaired_primaries.append((base_name, primary_id))
             else:
-                print(f"Warning: Primary file for base '{base_name}' (ID: {primary_id}) has no corresponding secondary file.", file=sys.stderr)
-                unpaired_primary_count += 1
+                orphaned_secondary_warnings.append(f"Warning: Secondary file for base '{base_name}' (ID: {secondary_id}) has no corresponding primary file.\n")
+
+        # Pairs and unpaired primaries are reported by sorted base name, orphaned secondaries in query order
+        pairs: List[Tuple[str, str]] = [(primary_id, secondary_id) for _, primary_id, secondary_id in sorted(paired)]
+        unpaired_primary_count = len(unpaired_primaries)
+        orphaned_secondary_count = len(orphaned_secondary_warnings)
+
+        print(f"\nIdentified {len(pairs) + unpaired_primary_count} unique primary base names for pairing.", file=sys.stderr)
+        print(f"Identified {len(pairs) + orphaned_secondary_count} unique secondary base names for pairing.", file=sys.stderr)
 
-        for base_name, secondary_id in secondary_files.items():
-            if base_name not in primary_files:
-                print(f"Warning: Secondary file for base '{base_name}' (ID: {secondary_id}) has no corresponding primary file.", file=sys.stderr)
-                orphaned_secondary_count += 1
+        pairing_warnings = [f"Warning: Primary file for base '{base_name}' (ID: {primary_id}) has no corresponding secondary file.\n"
+                            for base_name, primary_id in sorted(unpaired_primaries)]
+        pairing_warnings.extend(orphaned_secondary_warnings)
+        if pairing_warnings:
+            sys.stderr.write("".join(pairing_warnings))
 
         print(f"\nFound {len(pairs)} pairs.", file=sys.stderr)
         if unpaired_primary_count > 0:
@@ -191,4 +224,4 @@ class DXCommandGenerator(ABC):
         if orphaned_secondary_count > 0:
             print(f"{orphaned_secondary_count} secondary files did not have a matching primary file", file=sys.stderr)
 
-        return pairs
\ No newline at end of file
+        return pairs
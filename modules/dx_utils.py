@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import subprocess
 import json
 import sys
 import re
 import os
-from typing import List, Dict, Optional, Tuple, Set
+import tempfile
+import threading
+import time
+import hashlib
+from typing import Any, Callable, Iterator, List, Dict, Optional, Tuple, Set
+
+# A Pan number, e.g. 'Pan1234'; shared by the generators that parse sample names and Pan arguments
+PAN_NUMBER_RE = re.compile(r'Pan\d+', re.IGNORECASE)
+# The same pattern in bytes, as a RunManifest.csv is scanned undecoded
+_PAN_RE = re.compile(PAN_NUMBER_RE.pattern.encode(), re.IGNORECASE)
+# DNAnexus object IDs, e.g. 'project-xxxx' or 'file-xxxx'; only these are used as on-disk cache directory names
+_CACHE_NAMESPACE_RE = re.compile(r'[a-z]+-[0-9A-Za-z]+')
 
 class DXUtils:
     """
@@ -14,38 +27,137 @@ class DXUtils:
     Provides static methods for interacting with the DNAnexus platform.
     """
 
+    # Caching of dx query results; disabled until configure_cache() is given a positive TTL
+    _cache_dir: Optional[str] = None
+    _cache_ttl_seconds: int = 0
+    _memory_cache: Dict[Tuple[str, str], Any] = {}
+    # Queries already announced as answered from the on-disk cache, so a paged query is announced once
+    _announced_cache_hits: Set[str] = set()
+    # Project names never change within a run, so they are memoised even when caching is disabled
+    _project_names: Dict[str, str] = {}
+    # Likewise for the (project_id, project_name) a file lives in, keyed by file ID
+    _project_info: Dict[str, Tuple[str, str]] = {}
+    # Auth tokens keyed by (path, mtime_ns) so an edited token file is re-read
+    _auth_tokens: Dict[Tuple[str, int], str] = {}
+
+    @staticmethod
+    def configure_cache(cache_dir: Optional[str], ttl_seconds: int) -> None:
+        """
+        Enable or disable caching of dx query results.
+        
+        Args:
+            cache_dir: Directory for the on-disk cache ('~' is expanded). If empty, results
+                       are only cached in memory for the current process
+            ttl_seconds: How long cached results remain valid. 0 disables caching entirely
+        """
+        DXUtils._cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        DXUtils._cache_ttl_seconds = max(int(ttl_seconds or 0), 0)
+        DXUtils._memory_cache.clear()
+        DXUtils._announced_cache_hits.clear()
+
     @staticmethod
-    def run_dx_find_command(dx_command_args: List[str], command_description: str) -> List[Dict]:
+    def _cached(namespace: str, key_parts: Any, producer: Callable[[], Any], description: str) -> Any:
         """
-        Helper function to run a dx find data command and parse JSON output.
+        Return the cached result for key_parts, calling producer on a miss.
+        
+        Results are memoised in-process and, if a cache directory is configured, stored as
+        <cache_dir>/<namespace>/<sha256 of key_parts>.json for reuse by later runs within
+        the TTL. A notice is printed to stderr the first time a query reuses such a stored
+        result, as it may predate files added to the project since. None results are never cached.
         
         Args:
-            dx_command_args: List of command arguments to pass to the dx command
+            namespace: Cache subdirectory, the DNAnexus project or file ID the query is about.
+                       Anything else is only cached in memory
+            key_parts: JSON-serialisable description of the query
+            producer: Callable that performs the query
+            description: Human-readable description of the query for the cache notice. Calls
+                         sharing a description (e.g. the pages of one query) are announced once
+            
+        Returns:
+            Any: The cached or freshly produced (JSON-serialisable) result
+        """
+        if DXUtils._cache_ttl_seconds <= 0:
+            return producer()
+
+        memory_key, cache_path = DXUtils._cache_location(namespace, key_parts)
+        if memory_key in DXUtils._memory_cache:
+            return DXUtils._memory_cache[memory_key]
+
+        if cache_path:
+            try:
+                cache_age = time.time() - os.path.getmtime(cache_path)
+                if cache_age < DXUtils._cache_ttl_seconds:
+                    with open(cache_path, 'r') as f:
+                        result = json.load(f)
+                    DXUtils._memory_cache[memory_key] = result
+                    if description not in DXUtils._announced_cache_hits:
+                        DXUtils._announced_cache_hits.add(description)
+                        print(f"Note: Using a cached result for the {description}, stored {cache_age:.0f}s ago. "
+                              "Run with --no-cache to query DNAnexus again.", file=sys.stderr)
+                    return result
+            except (OSError, ValueError):
+                pass  # Missing, unreadable or corrupt entries are treated as a miss
+
+        result = producer()
+        if result is None:
+            return result
+
+        DXUtils._memory_cache[memory_key] = result
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'w') as f:
+                    json.dump(result, f)
+                os.replace(temp_path, cache_path)
+            except OSError as e:
+                print(f"Warning: Could not write dx cache entry {cache_path}: {e}", file=sys.stderr)
+        return result
+
+    @staticmethod
+    def _cache_location(namespace: str, key_parts: Any) -> Tuple[Tuple[str, str], Optional[str]]:
+        """
+        Return the in-memory key and on-disk path for key_parts. The path is None without a
+        cache directory, or if namespace is not a DNAnexus ID and so unsafe as a directory name.
+        """
+        key = hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode()).hexdigest()
+        cache_path = None
+        if DXUtils._cache_dir and _CACHE_NAMESPACE_RE.fullmatch(namespace):
+            cache_path = os.path.join(DXUtils._cache_dir, namespace, f"{key}.json")
+        return (namespace, key), cache_path
+
+    @staticmethod
+    def run_dx_api_command(resource: str, method: str, payload: Dict, command_description: str) -> Dict:
+        """
+        Helper function to call a DNAnexus API route via 'dx api' and parse the JSON reply.
+        
+        Args:
+            resource: API resource, e.g. 'system' or a project/file ID
+            method: API method, e.g. 'findDataObjects'
+            payload: JSON-serialisable request body
             command_description: Human-readable description of the command for error messages
             
         Returns:
-            List[Dict]: Parsed JSON output from the dx command
+            Dict: Parsed JSON reply from the API
             
         Raises:
             SystemExit: If the dx command fails, JSON parsing fails, or dx CLI is not found
         """
-        print(f"Executing: {' '.join(dx_command_args)}", file=sys.stderr)
+        dx_command_args = ["dx", "api", resource, method, json.dumps(payload, separators=(",", ":"))]
+        command_line = ' '.join(dx_command_args)  # Formatted once for both the progress and error messages
+        print(f"Executing: {command_line}", file=sys.stderr)
         try:
             process = subprocess.run(dx_command_args, capture_output=True, text=True, check=False)
 
             if process.returncode != 0:
                 print(f"Error executing {command_description} (return code {process.returncode}):", file=sys.stderr)
-                print(f"Command: {' '.join(dx_command_args)}", file=sys.stderr)
+                print(f"Command: {command_line}", file=sys.stderr)
                 if process.stderr:
                     print(f"dx stderr:\n{process.stderr}", file=sys.stderr)
                 if process.stdout and process.stdout.strip():
                     print(f"dx stdout (if error message present):\n{process.stdout}", file=sys.stderr)
                 sys.exit(1)
 
-            if not process.stdout.strip() and process.returncode == 0:
-                print(f"No files found by {command_description}. Proceeding.", file=sys.stderr)
-                return []
-
             return json.loads(process.stdout)
 
         except json.JSONDecodeError as e:
@@ -59,17 +171,97 @@ class DXUtils:
             print(f"An unexpected error occurred while running {command_description}: {e}", file=sys.stderr)
             sys.exit(1)
 
+    @staticmethod
+    def iter_data_objects(project_id: str, glob_pattern: str, file_class: str = "file",
+                          describe_fields: Tuple[str, ...] = ("name",)) -> Iterator[Dict]:
+        """
+        Find data objects matching a name glob using the findDataObjects API route.
+        
+        Unlike 'dx find data --json', which returns the full describe payload for every
+        match, only the requested describe fields are returned. Results are yielded one
+        page at a time, following the 'next' cursor until the query is exhausted, so only
+        a single page of the reply is held in memory.
+        
+        Args:
+            project_id: DNAnexus project ID to search (recursively from the root folder)
+            glob_pattern: Name glob to match, e.g. '*markdup.bam'
+            file_class: DNAnexus object class to match
+            describe_fields: Describe fields to include under each result's 'describe' key
+            
+        Yields:
+            Dict: Results in the same shape as 'dx find data --json', i.e. dicts with
+                  'project', 'id' and 'describe' keys
+            
+        Raises:
+            SystemExit: If any dx API call fails
+        """
+        payload: Dict[str, Any] = {
+            "scope": {"project": project_id, "folder": "/", "recurse": True},
+            "name": {"glob": glob_pattern},
+            "class": file_class,
+            "describe": {"fields": {field: True for field in describe_fields}},
+        }
+        command_description = f"'{glob_pattern}' file query"
+
+        result_count = 0
+        while True:
+            request = dict(payload)
+            response = DXUtils._cached(project_id, ["system", "findDataObjects", request],
+                                       lambda: DXUtils.run_dx_api_command("system", "findDataObjects", request, command_description),
+                                       f"{command_description} in {project_id}")
+            for result in response.get("results", []):
+                result_count += 1
+                yield result
+            if not response.get("next"):
+                break
+            payload["starting"] = response["next"]
+
+        if result_count == 0:
+            print(f"No files found by {command_description}. Proceeding.", file=sys.stderr)
+
+    @staticmethod
+    def find_data_objects(project_id: str, glob_pattern: str, file_class: str = "file",
+                          describe_fields: Tuple[str, ...] = ("name",)) -> List[Dict]:
+        """
+        List form of iter_data_objects, for callers that need every result at once.
+        
+        Args:
+            project_id: DNAnexus project ID to search (recursively from the root folder)
+            glob_pattern: Name glob to match, e.g. '*markdup.bam'
+            file_class: DNAnexus object class to match
+            describe_fields: Describe fields to include under each result's 'describe' key
+            
+        Returns:
+            List[Dict]: All matching results
+        """
+        return list(DXUtils.iter_data_objects(project_id, glob_pattern, file_class, describe_fields))
+
     @staticmethod
     def get_project_name(project_id: str) -> Optional[str]:
         """
         Get project name from project ID using 'dx describe'.
         
+        Successful lookups are memoised for the rest of the run.
+        
         Args:
             project_id: DNAnexus project ID (e.g., 'project-xxxx')
             
         Returns:
             Optional[str]: Project name if found, None if project cannot be described or doesn't exist
         """
+        if project_id in DXUtils._project_names:
+            return DXUtils._project_names[project_id]
+
+        project_name = DXUtils._cached(project_id, ["describe", project_id, "name"],
+                                       lambda: DXUtils._describe_project_name(project_id),
+                                       f"name of {project_id}")
+        if project_name is not None:
+            DXUtils._project_names[project_id] = project_name
+        return project_name
+
+    @staticmethod
+    def _describe_project_name(project_id: str) -> Optional[str]:
+        """Uncached lookup behind get_project_name."""
         try:
             dx_describe = subprocess.run(["dx", "describe", project_id, "--json"],
                                          capture_output=True, text=True, check=True)
@@ -82,7 +274,9 @@ class DXUtils:
     @staticmethod
     def detect_project_info(dx_file_id: str) -> Tuple[str, str]:
         """
-        Detect project ID and name from a DNAnexus file ID using 'dx describe'.
+        Detect project ID and name from a DNAnexus file ID using 'dx describe --json'.
+        
+        Successful detections are memoised for the rest of the run.
         
         Args:
             dx_file_id: DNAnexus file ID to get project information from
@@ -91,27 +285,29 @@ class DXUtils:
             Tuple[str, str]: A tuple containing (project_id, project_name).
                             Empty strings are returned if values cannot be detected.
         """
+        if dx_file_id in DXUtils._project_info:
+            return DXUtils._project_info[dx_file_id]
+
         project_id = ""
         project_name = ""
 
         print(f"Extracting project information from DNAnexus file {dx_file_id}...")
 
         try:
-            dx_describe_cmd = ["dx", "describe", dx_file_id]
-            print(f"Executing: {' '.join(dx_describe_cmd)}")
-            dx_describe_output = subprocess.check_output(dx_describe_cmd, text=True, stderr=subprocess.PIPE)
+            file_info = DXUtils._cached(dx_file_id, ["describe", dx_file_id, "location"],
+                                        lambda: DXUtils._describe_file_location(dx_file_id),
+                                        f"location of {dx_file_id}")
 
-            project_id_match = re.search(r"Project\s+(project-[a-zA-Z0-9]+)", dx_describe_output)
-            if project_id_match:
-                project_id = project_id_match.group(1)
+            if file_info.get("project"):
+                project_id = file_info["project"]
                 print(f"Detected Project ID: {project_id}")
             else:
                 print("Warning: Could not detect Project ID from dx describe output.")
 
-            folder_path_match = re.search(r"Folder\s+([^\n]+)", dx_describe_output)
-            if folder_path_match:
-                folder_path = folder_path_match.group(1).strip()
-                project_name_candidate = folder_path.lstrip('/').split('/')[0]
+            folder_path = file_info.get("folder")
+            if folder_path is not None:
+                folder_path = folder_path.strip()
+                project_name_candidate = folder_path.lstrip('/').partition('/')[0]
                 if project_name_candidate:
                     project_name = project_name_candidate
                     print(f"Detected Project Name (from folder path): {project_name}")
@@ -125,11 +321,25 @@ class DXUtils:
             print(f"Command output: {e.output}")
             print(f"Command error: {e.stderr}")
             print("Please check your DNAnexus login status and if the file ID is correct.")
+        except json.JSONDecodeError as e:
+            print(f"Error: Could not parse 'dx describe {dx_file_id} --json' output: {e}")
         except FileNotFoundError:
             print("Error: 'dx' command not found. Please ensure the DNAnexus toolkit is installed and in your PATH.")
 
+        # Only complete results are memoised, so a failed lookup is retried on the next call
+        if project_id and project_name:
+            DXUtils._project_info[dx_file_id] = (project_id, project_name)
         return project_id, project_name
 
+    @staticmethod
+    def _describe_file_location(dx_file_id: str) -> Dict[str, Optional[str]]:
+        """Uncached 'dx describe --json' behind detect_project_info, reduced to the file's project and folder."""
+        dx_describe_cmd = ["dx", "describe", dx_file_id, "--json"]
+        print(f"Executing: {' '.join(dx_describe_cmd)}")
+        dx_describe_output = subprocess.check_output(dx_describe_cmd, text=True, stderr=subprocess.PIPE)
+        file_info = json.loads(dx_describe_output)
+        return {"project": file_info.get("project"), "folder": file_info.get("folder")}
+
     @staticmethod
     def extract_pan_numbers(dx_file_id: str) -> Optional[Set[str]]:
         """
@@ -142,21 +352,59 @@ class DXUtils:
             Optional[Set[str]]: Set of unique Pan numbers found in the manifest.
                               Returns empty set if no Pan numbers found or if errors occur.
         """
-        pan_numbers = set()
+        # Closed DNAnexus files are immutable, so the result for a file ID can be reused
+        pan_numbers = DXUtils._cached(dx_file_id, ["cat", dx_file_id, "pan_numbers"],
+                                      lambda: DXUtils._read_pan_numbers(dx_file_id),
+                                      f"Pan numbers in {dx_file_id}")
+        return set(pan_numbers) if pan_numbers is not None else set()
 
+    @staticmethod
+    def iter_dx_cat_lines(dx_file_id: str, text: bool = True) -> Iterator[Any]:
+        """
+        Stream the lines of a DNAnexus file from 'dx cat', so it is never held in memory as a whole.
+        
+        Closing the generator before the end of the file (e.g. via contextlib.closing around a
+        loop that breaks early) kills dx, as the rest of the file is not needed. dx's stderr is
+        collected in a temporary file rather than a pipe, so dx cannot block on it while stdout
+        is being read.
+        
+        Args:
+            dx_file_id: DNAnexus file ID to read
+            text: Yield decoded str lines if True, raw bytes lines if False
+            
+        Yields:
+            Any: Each line of the file, including its line ending
+            
+        Raises:
+            subprocess.CalledProcessError: If dx fails; its stderr output is attached as e.stderr
+            FileNotFoundError: If the dx command-line tool is not found
+        """
+        dx_cat_cmd = ["dx", "cat", dx_file_id]
+        with tempfile.TemporaryFile() as stderr_file:
+            with subprocess.Popen(dx_cat_cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=text) as process:
+                try:
+                    yield from process.stdout
+                except GeneratorExit:
+                    process.kill()
+                    raise
+            if process.returncode != 0:
+                stderr_file.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, dx_cat_cmd,
+                                                    stderr=stderr_file.read().decode(errors='replace'))
+
+    @staticmethod
+    def _read_pan_numbers(dx_file_id: str) -> Optional[List[str]]:
+        """Uncached manifest scan behind extract_pan_numbers; returns None if the manifest could not be read."""
         try:
-            # Use dx cat to read the manifest file
-            dx_cat_cmd = ["dx", "cat", dx_file_id]
-            manifest_content = subprocess.check_output(dx_cat_cmd, text=True, stderr=subprocess.PIPE)
-
-            # Process each line
-            for line in manifest_content.splitlines():
-                line = line.strip()
-                if line:  # Skip empty lines
-                    # Look for Pan<number> pattern in the line
-                    pan_match = re.search(r'Pan\d+', line, re.IGNORECASE)
-                    if pan_match:
-                        pan_numbers.add(pan_match.group(0))
+            # Lines stay as bytes; only the (ASCII) Pan numbers found are decoded.
+            # A failed read raises, so a partial result is never returned.
+            streamed_pan_numbers = set()
+            for line in DXUtils.iter_dx_cat_lines(dx_file_id, text=False):
+                # Keep the first Pan number found on each line
+                pan_match = _PAN_RE.search(line)
+                if pan_match:
+                    streamed_pan_numbers.add(pan_match.group(0).decode('ascii'))
+            return sorted(streamed_pan_numbers)
 
         except subprocess.CalledProcessError as e:
             print(f"Error reading manifest file: {e}")
@@ -164,13 +412,15 @@ class DXUtils:
         except Exception as e:
             print(f"An unexpected error occurred while extracting Pan numbers: {e}")
 
-        return pan_numbers
+        return None
 
     @staticmethod
     def get_auth_token(dnanexus_auth_token_path: str) -> str:
         """
         Get authentication token from file.
         
+        The token is memoised for as long as the file's modification time is unchanged.
+        
         Args:
             dnanexus_auth_token_path: Path to the file containing the DNAnexus auth token
             
@@ -183,15 +433,21 @@ class DXUtils:
             IOError: If there are issues reading the auth token file
         """
         try:
-            if not os.path.isfile(dnanexus_auth_token_path):
-                raise FileNotFoundError(f"Auth token file not found at {dnanexus_auth_token_path}")
-                
-            with open(dnanexus_auth_token_path, 'r') as f:
+            try:
+                f = open(dnanexus_auth_token_path, 'r')
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Auth token file not found at {dnanexus_auth_token_path}") from None
+            with f:
+                # Keyed on the opened file itself, so the key always matches the contents read
+                cache_key = (dnanexus_auth_token_path, os.fstat(f.fileno()).st_mtime_ns)
+                if cache_key in DXUtils._auth_tokens:
+                    return DXUtils._auth_tokens[cache_key]
                 auth_token = f.read().strip()
                 
             if not auth_token:
                 raise ValueError(f"Auth token file {dnanexus_auth_token_path} is empty")
                 
+            DXUtils._auth_tokens[cache_key] = auth_token
             print(f"Successfully read auth token from {dnanexus_auth_token_path}")
             return auth_token
             
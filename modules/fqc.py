@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 from modules.dx_command_generator import DXCommandGenerator
 
@@ -26,65 +29,63 @@ class FastQCCommandGenerator(DXCommandGenerator):
         if not project_id:
             return
 
-        project_name = self._get_project_name(project_id)
-        if not project_name:
-            project_name = f"{project_id}_unknown_project" # Fallback if name not found
-            print(f"Could not determine project name, using '{project_name}' for output filename")
-        else:
-            print(f"Using project name '{project_name}' for output filename")
-        
-        output_file = f"{project_name.replace(' ', '_')}_fastqc_cmds.sh"
+        # The file query does not depend on the project name, so run it while the name is looked up
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fastq_pairs_future = executor.submit(self._find_fastq_pairs, project_id)
 
-        print(f"\nStarting FastQC command generation for project: {project_id}")
-        print(f"Commands will be written to: {output_file}")
+            project_name = self._get_project_name(project_id)
+            if not project_name:
+                project_name = f"{project_id}_unknown_project" # Fallback if name not found
+                print(f"Could not determine project name, using '{project_name}' for output filename")
+            else:
+                print(f"Using project name '{project_name}' for output filename")
+            
+            output_file = f"{project_name.replace(' ', '_')}_fastqc_cmds.sh"
 
-        if not self._initialize_output_file(output_file, project_id, project_name, "FastQC Analysis Commands"):
-            return
+            print(f"\nStarting FastQC command generation for project: {project_id}")
+            print(f"Commands will be written to: {output_file}")
 
-        fastq_pairs = self._find_fastq_pairs(project_id)
+            fastq_pairs = fastq_pairs_future.result()
 
         if not fastq_pairs:
             print("No FASTQ pairs found. No commands will be generated.")
             return
 
-        self._generate_fastqc_commands(fastq_pairs, output_file, project_id)
+        self._generate_fastqc_commands(fastq_pairs, output_file, project_id, project_name)
 
     def _find_fastq_pairs(self, project_id: str) -> List[Tuple[str, str]]:
-        """Finds R1/R2 FASTQ pairs in the project using common utility"""
-        r1_glob_pattern = "*_R1.fastq.gz"
-        r2_glob_pattern = "*_R2.fastq.gz"
+        """Finds R1/R2 FASTQ pairs in the project using a single combined query"""
+        # One query covers both reads; split them by suffix as results arrive
+        r1_files_data: List[Dict] = []
+        r2_files_data: List[Dict] = []
+        for item in self._iter_dx_files(project_id, "*_R?.fastq.gz"):
+            file_name = item.get('describe', {}).get('name', '')
+            if file_name.endswith("_R1.fastq.gz"):
+                r1_files_data.append(item)
+            elif file_name.endswith("_R2.fastq.gz"):
+                r2_files_data.append(item)
 
-        r1_files_data = self._find_dx_files(project_id, r1_glob_pattern)
-        r2_files_data = self._find_dx_files(project_id, r2_glob_pattern)
-        
         # The _pair_dx_files utility will handle stripping the suffixes correctly
         # based on the provided primary and secondary suffixes.
         return self._pair_dx_files(r1_files_data, "_R1.fastq.gz", r2_files_data, "_R2.fastq.gz")
 
     def _generate_fastqc_commands(self, fastq_pairs: List[Tuple[str, str]], 
-                                  output_file: str, project_id: str) -> None:
+                                  output_file: str, project_id: str, project_name: str) -> None:
         """Generates FastQC analysis commands"""
-        # Base command template
-        base_command = (
-            f"dx run {self.fastqc_applet_id} "
-            "-ireads={r1_id} "
-            "-ireads={r2_id} "
-            f"--dest {project_id} -y"
-        )
-
-        try:
-            with open(output_file, 'a') as f:
-                for i, (r1_id, r2_id) in enumerate(fastq_pairs, 1):
-                    command = base_command.format(r1_id=r1_id, r2_id=r2_id)
-                    f.write(f"{command}\n")
-                    print(f"Generated command {i}/{len(fastq_pairs)} for FASTQ pair: {r1_id}, {r2_id}", file=sys.stderr)
-
-            print(f"\nSuccessfully wrote {len(fastq_pairs)} commands to {output_file}", file=sys.stderr)
-
-        except IOError as e:
-            print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
+        # Constant parts of the command around the R1 and R2 IDs, built once for all pairs
+        command_prefix = f"dx run {self.fastqc_applet_id} -ireads="
+        command_middle = " -ireads="
+        command_suffix = f" --dest {project_id} -y\n"
+
+        commands = [command_prefix + r1_id + command_middle + r2_id + command_suffix
+                    for r1_id, r2_id in fastq_pairs]
+
+        if not self._write_output_script(output_file, project_id, project_name, "FastQC Analysis Commands",
+                                         body="".join(commands)):
             sys.exit(1)
 
+        print(f"\nSuccessfully wrote {len(fastq_pairs)} commands to {output_file}", file=sys.stderr)
+
 if __name__ == "__main__":
     generator = FastQCCommandGenerator()
     generator.generate()
\ No newline at end of file
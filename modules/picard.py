@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
 import os
 from datetime import datetime
@@ -42,16 +44,13 @@ class PicardCommandGenerator(DXCommandGenerator):
         print(f"\nStarting Picard command generation for project: {project_id}")
         print(f"Commands will be written to: {output_file}")
 
-        if not self._initialize_output_file(output_file, project_id, project_name, "Picard Analysis Commands"):
-            return
-
         bam_files = self._find_sorted_bams(project_id)
 
         if not bam_files:
             print("No sorted BAM files found. No commands will be generated.")
             return
 
-        self._generate_picard_commands(bam_files, output_file, project_id)
+        self._generate_picard_commands(bam_files, output_file, project_id, project_name)
 
     def _find_sorted_bams(self, project_id: str) -> List[str]:
         """Finds sorted BAM files in the project using common utility"""
@@ -60,7 +59,7 @@ class PicardCommandGenerator(DXCommandGenerator):
         
         return [item['id'] for item in bam_files_data if item['describe']['name'].endswith(".bam")]
 
-    def _generate_picard_commands(self, bam_files: List[str], output_file: str, project_id: str) -> None:
+    def _generate_picard_commands(self, bam_files: List[str], output_file: str, project_id: str, project_name: str) -> None:
         """Generates Picard analysis commands"""
         # Base command template from picard_extract.py
         base_command = (
@@ -72,19 +71,14 @@ class PicardCommandGenerator(DXCommandGenerator):
             f"--dest {project_id} -y"
         )
 
-        try:
-            with open(output_file, 'a') as f: # Append to initialized file
-                for i, bam_id in enumerate(bam_files, 1):
-                    command = base_command.format(bam_id=bam_id)
-                    f.write(f"{command}\n")
-                    print(f"Generated command {i}/{len(bam_files)} for BAM: {bam_id}", file=sys.stderr)
+        commands = [f"{base_command.format(bam_id=bam_id)}\n" for bam_id in bam_files]
 
-            print(f"\nSuccessfully wrote {len(bam_files)} commands to {output_file}", file=sys.stderr)
-
-        except IOError as e:
-            print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
+        if not self._write_output_script(output_file, project_id, project_name, "Picard Analysis Commands",
+                                         body="".join(commands)):
             sys.exit(1)
 
+        print(f"\nSuccessfully wrote {len(bam_files)} commands to {output_file}", file=sys.stderr)
+
 if __name__ == "__main__":
     generator = PicardCommandGenerator()
     generator.generate()
\ No newline at end of file
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 from modules.dx_command_generator import DXCommandGenerator
 import subprocess
 import re
@@ -58,32 +60,24 @@ class ReadcountCommandGenerator(DXCommandGenerator):
             pan_numlist = ",".join(sorted(pan_numbers))
             output_filename = f"{project_name.replace(' ', '_')}_readcount_cmd.sh"
 
-            # Initialize output file, including project vars
-            if not self._initialize_output_file(output_filename, project_id, project_name, "Readcount Analysis Commands"):
-                return
+            command = (
+                f"dx run {self.readcount_applet_id} --priority high -y --instance-type mem1_ssd1_v2_x8 --name \"ED_Readcount-CP2\" "
+                f"-ireference_genome={self.reference_genome} "
+                f"-ibedfile={self.readcount_bedfile} "
+                f"-ibam_str=\"*markdup.ba*\" "
+                f"-inormals_RData={self.normals_RData} "
+                f"-iproject_name=\"${{PROJECT_NAME}}\" " # Use shell variable
+                f"-ibamfile_pannumbers=\"{pan_numlist}\" "
+                f"--instance-type mem1_ssd1_v2_x36 "
+                f"--dest=\"${{PROJECT_ID}}\" --brief -y --auth \"${{AUTH_TOKEN}}\"\n" # Use shell variables
+            )
 
-            try:
-                with open(output_filename, 'a') as f: # Append to initialized file
-                    command = (
-                        f"dx run {self.readcount_applet_id} --priority high -y --instance-type mem1_ssd1_v2_x8 --name \"ED_Readcount-CP2\" "
-                        f"-ireference_genome={self.reference_genome} "
-                        f"-ibedfile={self.readcount_bedfile} "
-                        f"-ibam_str=\"*markdup.ba*\" "
-                        f"-inormals_RData={self.normals_RData} "
-                        f"-iproject_name=\"${{PROJECT_NAME}}\" " # Use shell variable
-                        f"-ibamfile_pannumbers=\"{pan_numlist}\" "
-                        f"--instance-type mem1_ssd1_v2_x36 "
-                        f"--dest=\"${{PROJECT_ID}}\" --brief -y --auth \"${{AUTH_TOKEN}}\"\n" # Use shell variables
-                    )
-                    f.write(command)
-                
-                print(f"\nGenerated readcount command script: {output_filename}")
-                print(f"To execute the command, run:\n  bash {os.path.abspath(output_filename)}")
-
-            except IOError as e:
-                print(f"Error: Could not write to output file {output_filename}: {e}")
+            if not self._write_output_script(output_filename, project_id, project_name, "Readcount Analysis Commands", body=command):
                 return
 
+            print(f"\nGenerated readcount command script: {output_filename}")
+            print(f"To execute the command, run:\n  bash {os.path.abspath(output_filename)}")
+
         except EOFError:
             print("\nInput cancelled. Exiting command generation.")
             return
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import os
 import re
 import subprocess
@@ -8,6 +10,38 @@ import tempfile
 from datetime import datetime
 from typing import List, Tuple, Optional, Any
 from modules.dx_command_generator import DXCommandGenerator
+from modules.dx_utils import PAN_NUMBER_RE
+
+# Fields of a sample name, e.g. NGS123_01_123456_R210_Pan4001_S1
+_R_NUMBER_RE = re.compile(r'R\d+(?:\.\d+)?')
+_WES_RE = re.compile(r'SingletonWES|WES', re.IGNORECASE)
+_BATCH_RE = re.compile(r'(NGS\d+[A-Za-z0-9]*?)(?:_|$)')
+# Sample name at the start of a RunManifest.csv line
+_MANIFEST_SAMPLE_RE = re.compile(r"^(NGS\d+[A-Za-z0-9_.-]*)(?:,.*)?")
+
+# CP2 workflow run for a single sample; PROJECT_ID, PROJECT_NAME and AUTH_TOKEN are shell variables
+_CP2_RUN_COMMAND_TEMPLATE = (
+    "dx run {workflow_id} --priority high -y --name \"{sample_name}\" "
+    "-istage-Ff0P5Jj0GYKY717pKX3vX8Z3.reads=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R1.fastq.gz\" "
+    "-istage-Ff0P5Jj0GYKY717pKX3vX8Z3.reads=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R2.fastq.gz\" "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.reads_fastqgzs=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R1.fastq.gz\" "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.reads2_fastqgzs=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R2.fastq.gz\" "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.output_metrics=true "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.germline_algo=Haplotyper "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.sample=\"{sample_name}\" "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.output_gvcf=true "
+    "-istage-Ff0P73j0GYKX41VkF3j62F9j.gvcftyper_algo_options='--genotype_model multinomial' "
+    "-istage-G77VfJ803JGy589J21p7Jkqj.bedfile=\"{variant_bed}\" "
+    "-istage-Ff0P5pQ0GYKVBB0g1FG27BV8.Capture_panel=Hybridisation "
+    "-istage-Ff0P5pQ0GYKVBB0g1FG27BV8.vendor_exome_bedfile=\"{variant_bed}\" "
+    "-istage-Ff0P82Q0GYKQ4j8b4gXzjqxX.coverage_level=30 "
+    "-istage-Ff0P82Q0GYKQ4j8b4gXzjqxX.sambamba_bed=\"{coverage_bed}\" "
+    "-istage-GK8G6p803JGx48f74jf16Kjx.skip={cnv_stage_skip} "
+    "-istage-GK8G6p803JGx48f74jf16Kjx.prefix=\"{sample_name}\" "
+    "-istage-GK8G6p803JGx48f74jf16Kjx.panel_bed=\"{variant_bed}\" "
+    "-istage-GK8G6k003JGx48f74jf16Kjv.skip={prs_skip} {polyedge_params} "
+    "--dest=\"${{PROJECT_ID}}\" --brief --auth \"${{AUTH_TOKEN}}\" -y\n"
+)
 
 class CP2WorkflowGenerator(DXCommandGenerator):
     """Generates commands for CP2 workflow"""
@@ -16,6 +50,8 @@ class CP2WorkflowGenerator(DXCommandGenerator):
         super().__init__()
         self.cp2_workflow_id = self.config_values.get('workflow')
         self.common_data_project = self.config_values.get('common_data_project')
+        self.variant_bedfile = self.config_values.get('variant_bedfile')
+        self.sambamba_bed = self.config_values.get('sambamba_bed')
 
     @property
     def name(self) -> str:
@@ -87,31 +123,25 @@ class CP2WorkflowGenerator(DXCommandGenerator):
         temp_file_path = ""
 
         try:
-            with tempfile.NamedTemporaryFile(delete=False, mode='w+t', suffix=".txt") as temp_f:
-                temp_file_path = temp_f.name
-
             dx_cat_cmd = ["dx", "cat", dx_file_id]
             print(f"Executing: {' '.join(dx_cat_cmd)}")
-            dx_cat_output = subprocess.check_output(dx_cat_cmd, text=True, stderr=subprocess.PIPE)
 
-            samples = []
-            for line in dx_cat_output.splitlines():
-                line = line.strip()
-                match = re.match(r"^(NGS\d+[A-Za-z0-9_.-]*)(?:,.*)?", line)
-                if match:
-                    sample_name = match.group(1)
-                    samples.append(sample_name)
+            # Stream dx cat output line by line, writing sample names straight to the temporary file
+            sample_count = 0
+            with tempfile.NamedTemporaryFile(delete=False, mode='w+t', suffix=".txt") as temp_f:
+                temp_file_path = temp_f.name
+                for line in self._iter_dx_cat_lines(dx_file_id):
+                    match = _MANIFEST_SAMPLE_RE.match(line.strip())
+                    if match:
+                        temp_f.write(f"{match.group(1)}\n")
+                        sample_count += 1
 
-            if not samples:
+            if not sample_count:
                 print(f"Error: No samples found in the DNAnexus file '{dx_file_id}'. The file might be empty or not in the expected format (e.g., one sample identifier per line, or CSV with sample in first column, starting with NGS).")
                 os.unlink(temp_file_path)
                 return None
 
-            with open(temp_file_path, 'w') as f_out:
-                for sample_name in samples:
-                    f_out.write(f"{sample_name}\n")
-
-            print(f"Found {len(samples)} samples in the DNAnexus file. Stored in temporary file: {temp_file_path}")
+            print(f"Found {sample_count} samples in the DNAnexus file. Stored in temporary file: {temp_file_path}")
             return temp_file_path
 
         except subprocess.CalledProcessError as e:
@@ -133,47 +163,44 @@ class CP2WorkflowGenerator(DXCommandGenerator):
                 os.unlink(temp_file_path)
             return None
 
-    def _process_sample(self, sample_name: str, output_file: str, failures_csv: str,
+    def _process_sample(self, sample_name: str, run_commands: List[str], failures: List[str],
                          project_id_val: str, project_name_val: str) -> bool:
-        """Process a single sample and generate run command"""
+        """Process a single sample, appending its run command to run_commands or its failure CSV row to failures"""
         print(f"\nProcessing sample: {sample_name}")
 
-        r_number_match = re.search(r'R\d+(?:\.\d+)?', sample_name)
+        r_number_match = _R_NUMBER_RE.search(sample_name)
         r_number = r_number_match.group(0) if r_number_match else None
 
-        if not r_number and re.search(r'SingletonWES|WES', sample_name, re.IGNORECASE):
+        if not r_number and _WES_RE.search(sample_name):
             r_number = "WES"
             print("  Info: Detected WES sample without standard R number, using special WES configuration.")
         elif not r_number:
             msg = f"Could not extract R number from sample name: {sample_name}. Expected format: *R[number]* or *SingletonWES* or *WES*."
             print(f"  Warning: {msg}")
-            with open(failures_csv, 'a') as f:
-                f.write(f'"{sample_name}","{msg}"\n')
+            failures.append(f'"{sample_name}","{msg}"\n')
             return False
 
-        pan_code_match = re.search(r'Pan\d+', sample_name, re.IGNORECASE)
+        pan_code_match = PAN_NUMBER_RE.search(sample_name)
         pan_code = pan_code_match.group(0) if pan_code_match else None
 
         if not pan_code:
             msg = f"Could not extract Pan code from sample name: {sample_name}. Expected format: *Pan[number]*."
             print(f"  Warning: {msg}")
-            with open(failures_csv, 'a') as f:
-                f.write(f'"{sample_name}","{msg}"\n')
+            failures.append(f'"{sample_name}","{msg}"\n')
             return False
 
-        batch_pool_match = re.search(r'(NGS\d+[A-Za-z0-9]*?)(?:_|$)', sample_name)
+        batch_pool_match = _BATCH_RE.search(sample_name)
         batch = batch_pool_match.group(1) if batch_pool_match else None
 
         if not batch:
             msg = f"Could not detect batch information (starting with NGS) from sample name '{sample_name}'."
             print(f"  Warning: {msg}")
-            with open(failures_csv, 'a') as f:
-                f.write(f'"{sample_name}","{msg}"\n')
+            failures.append(f'"{sample_name}","{msg}"\n')
             return False
 
-        # Bed files
-        variant_bed = self.config_values.get('variant_bedfile')
-        coverage_bed = self.config_values.get('sambamba_bed')
+        # Bed files, read from config once in __init__
+        variant_bed = self.variant_bedfile
+        coverage_bed = self.sambamba_bed
 
         prs_skip = "true"
         if r_number == "R134":
@@ -198,37 +225,19 @@ class CP2WorkflowGenerator(DXCommandGenerator):
 
         # Generate single-line command
         # Use self.cp2_workflow_id from config
-        run_command = (
-            f"dx run {self.cp2_workflow_id} --priority high -y --name \"{sample_name}\" "
-            f"-istage-Ff0P5Jj0GYKY717pKX3vX8Z3.reads=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R1.fastq.gz\" "
-            f"-istage-Ff0P5Jj0GYKY717pKX3vX8Z3.reads=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R2.fastq.gz\" "
-            f"-istage-Ff0P73j0GYKX41VkF3j62F9j.reads_fastqgzs=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R1.fastq.gz\" "
-            f"-istage-Ff0P73j0GYKX41VkF3j62F9j.reads2_fastqgzs=\"${{PROJECT_ID}}:/${{PROJECT_NAME}}/Samples/{sample_name}_R2.fastq.gz\" "
-            "-istage-Ff0P73j0GYKX41VkF3j62F9j.output_metrics=true "
-            "-istage-Ff0P73j0GYKX41VkF3j62F9j.germline_algo=Haplotyper "
-            f"-istage-Ff0P73j0GYKX41VkF3j62F9j.sample=\"{sample_name}\" "
-            "-istage-Ff0P73j0GYKX41VkF3j62F9j.output_gvcf=true "
-            "-istage-Ff0P73j0GYKX41VkF3j62F9j.gvcftyper_algo_options='--genotype_model multinomial' "
-            f"-istage-G77VfJ803JGy589J21p7Jkqj.bedfile=\"{variant_bed}\" "
-            "-istage-Ff0P5pQ0GYKVBB0g1FG27BV8.Capture_panel=Hybridisation "
-            f"-istage-Ff0P5pQ0GYKVBB0g1FG27BV8.vendor_exome_bedfile=\"{variant_bed}\" "
-            "-istage-Ff0P82Q0GYKQ4j8b4gXzjqxX.coverage_level=30 "
-            f"-istage-Ff0P82Q0GYKQ4j8b4gXzjqxX.sambamba_bed=\"{coverage_bed}\" "
-            f"-istage-GK8G6p803JGx48f74jf16Kjx.skip={cnv_stage_skip} "
-            f"-istage-GK8G6p803JGx48f74jf16Kjx.prefix=\"{sample_name}\" "
-            f"-istage-GK8G6p803JGx48f74jf16Kjx.panel_bed=\"{variant_bed}\" "
-            f"-istage-GK8G6k003JGx48f74jf16Kjv.skip={prs_skip} {polyedge_params} "
-            f"--dest=\"${{PROJECT_ID}}\" --brief --auth \"${{AUTH_TOKEN}}\" -y\n"
+        run_command = _CP2_RUN_COMMAND_TEMPLATE.format(
+            workflow_id=self.cp2_workflow_id,
+            sample_name=sample_name,
+            variant_bed=variant_bed,
+            coverage_bed=coverage_bed,
+            cnv_stage_skip=cnv_stage_skip,
+            prs_skip=prs_skip,
+            polyedge_params=polyedge_params
         )
 
-        try:
-            with open(output_file, 'a') as f:
-                f.write(run_command)
-        except IOError as e:
-            print(f"  Error: Could not write to output file {output_file}: {e}")
-            return False
+        run_commands.append(run_command)
 
-        print(f"  ✓ Added run command for {sample_name} to {output_file}")
+        print(f"  ✓ Added run command for {sample_name}")
         print(f"    - R-Number: {r_number}")
         print(f"    - Pan Code: {pan_code}")
         print(f"    - Batch Info: {batch}")
@@ -257,9 +266,6 @@ class CP2WorkflowGenerator(DXCommandGenerator):
         output_filename = args.output
         print(f"Using output script filename: {output_filename}")
 
-        if not self._initialize_output_file(output_filename, project_id_to_use, project_name_to_use, "CP2 Workflow Commands"):
-            return
-
         failures_csv_file = args.failures if args.failures else "failures.csv"
         try:
             with open(failures_csv_file, 'w') as f:
@@ -271,6 +277,9 @@ class CP2WorkflowGenerator(DXCommandGenerator):
         processed_count = 0
         failed_count = 0
         samples_to_process = []
+        # Collected across all samples and written once each after the loop
+        run_commands: List[str] = []
+        failures: List[str] = []
 
         if args.dxfile:
             print(f"Attempting to extract samples from DNAnexus file: {args.dxfile}")
@@ -294,8 +303,10 @@ class CP2WorkflowGenerator(DXCommandGenerator):
                     os.unlink(temp_file_created_path)
                 return
             try:
+                # Sample lists are small; read them in one call rather than line by line
                 with open(sample_file_path, 'r') as f_samples:
-                    samples_to_process = [line.strip() for line in f_samples if line.strip() and not line.startswith('#')]
+                    sample_lines = f_samples.read().splitlines()
+                samples_to_process = [line.strip() for line in sample_lines if line.strip() and not line.startswith('#')]
                 print(f"Read {len(samples_to_process)} samples from file: {sample_file_path}")
             except IOError as e:
                 print(f"Error: Could not read sample file '{sample_file_path}': {e}")
@@ -308,20 +319,31 @@ class CP2WorkflowGenerator(DXCommandGenerator):
         else:
             total_samples = len(samples_to_process)
             for i, sample_name_raw in enumerate(samples_to_process, 1):
-                sample_name = sample_name_raw.strip().split(',')[0]
+                sample_name = sample_name_raw.strip().partition(',')[0]
                 print(f"\n--- [{i}/{total_samples}] Processing: {sample_name} ---")
-                if self._process_sample(sample_name, output_filename, failures_csv_file, project_id_to_use, project_name_to_use):
+                if self._process_sample(sample_name, run_commands, failures, project_id_to_use, project_name_to_use):
                     processed_count += 1
                 else:
                     failed_count += 1
                 print("--------------------------------------------")
 
+        if failures:
+            try:
+                with open(failures_csv_file, 'a') as f:
+                    f.write("".join(failures))
+            except IOError as e:
+                print(f"Warning: Could not write to failures CSV {failures_csv_file}: {e}")
+
         if temp_file_created_path and os.path.exists(temp_file_created_path):
             try:
                 os.unlink(temp_file_created_path)
             except OSError as e:
                 print(f"Warning: Could not delete temporary file {temp_file_created_path}: {e}")
 
+        if not self._write_output_script(output_filename, project_id_to_use, project_name_to_use, "CP2 Workflow Commands",
+                                         body="".join(run_commands)):
+            return
+
         print("\n========= Workflow Generation Summary =========")
         print(f"  Output script: {os.path.abspath(output_filename)}")
         print(f"  Total samples for which commands were generated: {processed_count}")
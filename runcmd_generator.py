@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
+import argparse
 import sys
 import yaml
 from typing import List
@@ -9,15 +12,27 @@ from modules.picard import PicardCommandGenerator
 from modules.fqc import FastQCCommandGenerator
 from modules.readcount import ReadcountCommandGenerator
 from modules.cnv import CNVCommandGenerator, CNVReanalysisCommandGenerator
+from modules.dx_utils import DXUtils
 from config import Config 
 
 def main():
     """Main function to select and run a command generator"""
 
+    parser = argparse.ArgumentParser(description="Generate DNAnexus commands for the CP2 pipeline")
+    # Read by the generators that take a project ID; they prompt for one if it is omitted
+    parser.add_argument("project_id", nargs="?", help="DNAnexus project ID (e.g., project-xxxx)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Query DNAnexus directly, ignoring any dx results cached by earlier runs")
+    args = parser.parse_args()
+
     # Load config and version
     config_instance = Config()
     version = config_instance.get('version', 'unknown')
 
+    # Caching of dx query results is opt-in via dx_cache_ttl_seconds, and can be bypassed for a run with --no-cache
+    cache_ttl_seconds = 0 if args.no_cache else config_instance.get('dx_cache_ttl_seconds', 0)
+    DXUtils.configure_cache(config_instance.get('dx_cache_dir'), cache_ttl_seconds)
+
     # List of available command generators
     generators: List[CommandGenerator] = [
         CP2WorkflowGenerator(),